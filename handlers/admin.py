@@ -1,20 +1,23 @@
 import logging
+from functools import wraps
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
-from handlers.conversation import admin_only
+from handlers.conversation import admin_only, _schedule_flush
 
 logger = logging.getLogger("telegram_bot")
 
-# List of admin user IDs - move to config in production
-ADMIN_USERS = [352475318]  # Replace with actual admin user IDs
+# Admin user IDs - move to config in production. frozenset gives O(1)
+# membership checks on every admin-gated call.
+ADMIN_USERS: frozenset = frozenset({352475318})
 
 def admin_required(func):
     """Decorator to restrict commands to admin users only."""
+    @wraps(func)
     async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         if user_id not in ADMIN_USERS:
             await update.message.reply_text("Sorry, this command is restricted to admins.")
-            logger.warning(f"Non-admin user {user_id} attempted to use admin command")
+            logger.warning("Non-admin user %s attempted to use admin command", user_id)
             return
         return await func(update, context)
     return wrapper
@@ -25,29 +28,35 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("Bot statistics: (placeholder)")
     logger.info(f"Admin {update.effective_user.id} requested stats")
 
+# Prebuilt replies indexed by the new state (False -> disabled, True -> enabled)
+_CF_REPLIES = (
+    "❌ Channel filter has been disabled.\n\n"
+    "When enabled, messages sent from external channels will be automatically deleted.",
+    "✅ Channel filter has been enabled.\n\n"
+    "When enabled, messages sent from external channels will be automatically deleted.",
+)
+
 @admin_only
 async def toggle_channel_filter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Toggle channel filter mode for the chat."""
     current_state = context.chat_data.get("channelFilterEnabled", False)
     new_state = not current_state
     context.chat_data["channelFilterEnabled"] = new_state
-    
-    # Ensure data is marked for persistence
-    await context.application.update_persistence()
-    
+
+    # Persist soon, but debounced - don't block the reply on a full flush
+    _schedule_flush(context.application)
+
+    await update.message.reply_text(_CF_REPLIES[new_state])
+
     status = "enabled" if new_state else "disabled"
-    emoji = "✅" if new_state else "❌"
-    
-    await update.message.reply_text(
-        f"{emoji} Channel filter has been {status}.\n\n"
-        f"When enabled, messages sent from external channels will be automatically deleted."
-    )
-    
-    logger.info(f"Channel filter {status} in chat {update.effective_chat.id} by user {update.effective_user.id}")
+    logger.info("Channel filter %s in chat %s by user %s", status, update.effective_chat.id, update.effective_user.id)
 
 def register_admin_handlers(application):
     """Register admin handlers with the application."""
-    #application.add_handler(CommandHandler("toggle_channel_filter", toggle_channel_filter))
+    # Chat-admin gated via @admin_only; /status advertises this command and
+    # filter_message, /whitelist_channel etc. all key off the flag it toggles
+    application.add_handler(CommandHandler("toggle_channel_filter", toggle_channel_filter))
+    # /stats stays unregistered - it's a placeholder superseded by /admin_stats
     #application.add_handler(CommandHandler("stats", stats))
-    
-    logger.info("Admin handlers registered") 
+
+    logger.info("Admin handlers registered")
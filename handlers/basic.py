@@ -5,7 +5,6 @@ import asyncio
 
 logger = logging.getLogger("telegram_bot")
 
-import yt_dlp
 import re
 import os
 import uuid
@@ -17,6 +16,10 @@ async def download_instagram_reel(url: str) -> str:
     loop = asyncio.get_running_loop()
 
     def _download():
+        # Imported here rather than at module load - yt_dlp pulls in a big
+        # dependency tree and is only needed once someone posts a reel
+        import yt_dlp
+
         unique_id = uuid.uuid4().hex[:8]
 
         # Base options
@@ -1,264 +1,699 @@
-import logging
-from telegram import Update
-from telegram.ext import (
-    CommandHandler,
-    ContextTypes,
-)
-from functools import wraps
-
-logger = logging.getLogger("telegram_bot")
-
-async def is_user_admin(update: Update) -> bool:
-    """Check if the user is an admin in the chat."""
-    try:
-        user_id = update.effective_user.id
-        chat_id = update.effective_chat.id
-        
-        # For private chats, consider the user as admin
-        if update.effective_chat.type == "private":
-            logger.debug(f"User {user_id} automatically admin in private chat")
-            return True
-            
-        # Get chat administrators
-        chat_admins = await update.effective_chat.get_administrators()
-        admin_ids = [admin.user.id for admin in chat_admins]
-        
-        is_admin = user_id in admin_ids
-        logger.debug(f"Admin check for user {user_id} in chat {chat_id}: {is_admin}")
-        logger.debug(f"Admin IDs in chat: {admin_ids}")
-        
-        return is_admin
-    except Exception as e:
-        logger.error(f"Error checking admin status: {str(e)}")
-        # Default to not admin if there's an error
-        return False
-
-
-def admin_only(func):
-    """Decorator to restrict commands to admins only."""
-    @wraps(func)
-    async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
-        try:
-            if not await is_user_admin(update):
-                logger.warning(f"Unauthorized access attempt by user {update.effective_user.id} in chat {update.effective_chat.id}")
-                await update.message.reply_text("⚠️ This command is restricted to admins only.")
-                return
-            logger.info(f"Admin access granted to user {update.effective_user.id} in chat {update.effective_chat.id}")
-            return await func(update, context, *args, **kwargs)
-        except Exception as e:
-            logger.error(f"Error in admin_only wrapper: {str(e)}")
-            await update.message.reply_text("An error occurred while checking permissions.")
-    return wrapped
-
-
-@admin_only
-async def enable_janitor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Enable the janitor feature in this chat."""
-    context.chat_data["janitorEnabled"] = True
-    
-    await update.message.reply_text("Janitor has been enabled for this chat!")
-    logger.info(f"Janitor enabled in chat {update.effective_chat.id}")
-
-
-@admin_only
-async def disable_janitor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Disable the janitor feature in this chat."""
-    context.chat_data["janitorEnabled"] = False
-    
-    await update.message.reply_text("Janitor has been disabled for this chat!")
-    logger.info(f"Janitor disabled in chat {update.effective_chat.id}")
-
-
-async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Display the current settings."""
-    janitor_status = context.chat_data.get("janitorEnabled", False)
-    channel_filter_status = context.chat_data.get("channelFilterEnabled", False)
-    
-    # Count filter patterns
-    filter_count = 0
-    if "filter_patterns" in context.chat_data and context.chat_data["filter_patterns"]:
-        filter_count = len(context.chat_data["filter_patterns"])
-    
-    janitor_text = "enabled" if janitor_status else "disabled"
-    channel_filter_text = "enabled" if channel_filter_status else "disabled"
-    
-    status_text = f"""
-*Current settings for this chat:*
-
-🧹 *Janitor:* {janitor_text}
-📺 *Channel Filter:* {channel_filter_text}
-🔍 *Active Filters:* {filter_count} pattern(s)
-
-*Available Commands:*
-• `/enable_janitor` / `/disable_janitor` - Toggle message filtering
-• `/toggle_channel_filter` - Toggle external channel message filtering
-• `/add_filter <pattern>` - Add regex filter
-• `/remove_filter <number>` - Remove filter
-• `/list_filters` - Show all filters
-    """
-    
-    await update.message.reply_text(status_text, parse_mode="Markdown")
-    logger.info(f"Settings displayed for chat {update.effective_chat.id}")
-
-
-async def check_admin_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Debug command to check if a user is an admin, using the best available display name."""
-    try:
-        user = update.effective_user
-        
-        who = (
-            f"@{user.username}"
-            if user.username
-            else (str(user.id))
-        )
-
-        is_admin = await is_user_admin(update)
-
-        if is_admin:
-            await update.message.reply_text(f"✅ {who} is an admin in this chat.")
-        else:
-            await update.message.reply_text(f"❌ {who} is NOT an admin in this chat.")
-
-        logger.info(f"Admin status check: {who} ({user.id}) in chat {update.effective_chat.id} is admin: {is_admin}")
-    except Exception as e:
-        logger.error(f"Error checking admin status: {e}")
-        await update.message.reply_text("Error checking admin status.")
-
-
-
-async def check_all_permissions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Debug command to check all permissions for the bot in the current chat."""
-    try:
-        chat_id = update.effective_chat.id
-        chat_type = update.effective_chat.type
-        bot_id = context.bot.id
-        
-        # For private chats, bot has all permissions
-        if chat_type == "private":
-            await update.message.reply_text(
-                "✅ *Private Chat - Bot has all permissions*\n\n"
-                "In private chats, the bot can perform all actions.",
-                parse_mode="Markdown"
-            )
-            logger.info(f"Bot permission check: Bot {bot_id} in private chat - all permissions granted")
-            return
-        
-        # Get bot's member info in the chat
-        try:
-            bot_member = await update.effective_chat.get_member(bot_id)
-            status = bot_member.status
-            
-            # Build permission report for the bot
-            permission_text = f"*Bot Permission Report*\n\n"
-            permission_text += f"**Chat:** {update.effective_chat.title or 'Unknown'}\n"
-            permission_text += f"**Chat Type:** {chat_type}\n"
-            permission_text += f"**Bot Status:** {status}\n"
-            permission_text += f"**Bot ID:** {bot_id}\n\n"
-            
-            if status == "administrator":
-                # Check specific admin permissions for the bot
-                bot_perms = []
-                
-                # Critical permissions for bot functionality
-                if hasattr(bot_member, 'can_delete_messages') and bot_member.can_delete_messages:
-                    bot_perms.append("✅ Can delete messages")
-                else:
-                    bot_perms.append("❌ **Cannot delete messages** (CRITICAL)")
-                
-                if hasattr(bot_member, 'can_restrict_members') and bot_member.can_restrict_members:
-                    bot_perms.append("✅ Can restrict members")
-                else:
-                    bot_perms.append("❌ Cannot restrict members")
-                
-                if hasattr(bot_member, 'can_change_info') and bot_member.can_change_info:
-                    bot_perms.append("✅ Can change chat info")
-                else:
-                    bot_perms.append("❌ Cannot change chat info")
-                
-                if hasattr(bot_member, 'can_invite_users') and bot_member.can_invite_users:
-                    bot_perms.append("✅ Can invite users")
-                else:
-                    bot_perms.append("❌ Cannot invite users")
-                
-                if hasattr(bot_member, 'can_pin_messages') and bot_member.can_pin_messages:
-                    bot_perms.append("✅ Can pin messages")
-                else:
-                    bot_perms.append("❌ Cannot pin messages")
-                
-                if hasattr(bot_member, 'can_manage_chat') and bot_member.can_manage_chat:
-                    bot_perms.append("✅ Can manage chat")
-                else:
-                    bot_perms.append("❌ Cannot manage chat")
-                
-                if hasattr(bot_member, 'can_manage_video_chats') and bot_member.can_manage_video_chats:
-                    bot_perms.append("✅ Can manage video chats")
-                else:
-                    bot_perms.append("❌ Cannot manage video chats")
-                
-                permission_text += "🤖 **BOT IS ADMINISTRATOR**\n\n"
-                permission_text += "**Bot Permissions:**\n"
-                permission_text += "\n".join(bot_perms)
-                
-                # Check if bot can perform its core functions
-                can_delete = hasattr(bot_member, 'can_delete_messages') and bot_member.can_delete_messages
-                
-                permission_text += "\n\n**Bot Functionality Status:**\n"
-                if can_delete:
-                    permission_text += "✅ Message filtering will work\n"
-                    permission_text += "✅ Channel filtering will work\n"
-                    permission_text += "✅ Janitor mode will work"
-                else:
-                    permission_text += "❌ **Message filtering will NOT work**\n"
-                    permission_text += "❌ **Channel filtering will NOT work**\n"
-                    permission_text += "❌ **Janitor mode will NOT work**\n\n"
-                    permission_text += "⚠️ **Bot needs 'Delete Messages' permission to function properly!**"
-                
-            elif status == "member":
-                permission_text += "👤 **BOT IS REGULAR MEMBER**\n\n"
-                permission_text += "❌ **Bot has NO admin permissions**\n"
-                permission_text += "❌ **Cannot delete messages**\n"
-                permission_text += "❌ **Message filtering will NOT work**\n"
-                permission_text += "❌ **Channel filtering will NOT work**\n"
-                permission_text += "❌ **Janitor mode will NOT work**\n\n"
-                permission_text += "⚠️ **Bot needs to be promoted to administrator with 'Delete Messages' permission!**"
-                
-            elif status == "restricted":
-                permission_text += "🚫 **BOT IS RESTRICTED**\n\n"
-                permission_text += "❌ **Bot has restricted permissions**\n"
-                permission_text += "❌ **Most bot functions will NOT work**"
-                
-            elif status == "left":
-                permission_text += "👻 **BOT HAS LEFT THE CHAT**\n\n"
-                permission_text += "❌ **Bot is not in this chat**"
-                
-            elif status == "kicked":
-                permission_text += "🚫 **BOT IS BANNED**\n\n"
-                permission_text += "❌ **Bot has been kicked from this chat**"
-            
-            await update.message.reply_text(permission_text, parse_mode="Markdown")
-            logger.info(f"Bot permission check completed for chat {chat_id}: status={status}")
-            
-        except Exception as member_error:
-            logger.error(f"Error getting bot member info: {member_error}")
-            await update.message.reply_text(
-                f"❌ **Error checking bot permissions**\n\n"
-                f"Could not retrieve bot member information.\n"
-                f"Error: {str(member_error)}",
-                parse_mode="Markdown"
-            )
-            
-    except Exception as e:
-        logger.error(f"Error in check_all_permissions: {str(e)}")
-        await update.message.reply_text("❌ Error checking bot permissions.")
-
-
-def register_conversation_handlers(application):
-    """Register command handlers with the application."""
-    # Add command handlers
-    #application.add_handler(CommandHandler("enable_janitor", enable_janitor))
-    #application.add_handler(CommandHandler("disable_janitor", disable_janitor))
-    #application.add_handler(CommandHandler("status", show_settings))
-    #application.add_handler(CommandHandler("amiadmin", check_admin_status))
-    application.add_handler(CommandHandler("botperms", check_all_permissions))
-    
-    logger.info("Settings handlers registered") 
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+from telegram import Update
+from telegram.ext import (
+    ChatMemberHandler,
+    CommandHandler,
+    ContextTypes,
+    MessageHandler,
+    filters,
+)
+from functools import wraps
+
+logger = logging.getLogger("telegram_bot")
+
+# How long (seconds) a forwarded message stays "seen" before it may be
+# re-posted. Stored as epoch floats: cheaper than datetime objects on the
+# per-forward hot path and smaller in the pickled persistence file.
+FSP_WINDOW = 86400
+
+# Debounced persistence: one pending flush task at a time, so a burst of
+# N updates costs a single pickle write instead of N.
+_pending_flush: Optional[asyncio.Task] = None
+
+
+def _schedule_flush(application, delay: float = 2.0) -> None:
+    """Schedule a debounced persistence flush if one isn't already pending."""
+    global _pending_flush
+    if _pending_flush is not None and not _pending_flush.done():
+        return
+    _pending_flush = asyncio.create_task(_flush_later(application, delay))
+
+
+async def _flush_later(application, delay: float) -> None:
+    global _pending_flush
+    try:
+        await asyncio.sleep(delay)
+        await application.update_persistence()
+    except Exception as e:
+        logger.error("Error flushing persistence: %s", e)
+    finally:
+        _pending_flush = None
+
+# Cache of chat_id -> (fetched_at, frozenset of admin user ids) so repeated
+# admin-gated commands in the same chat don't re-hit get_administrators().
+# With event-driven invalidation below, the TTL is only a safety net for
+# missed updates, so it can be generous.
+_ADMIN_CACHE_TTL = 3600  # seconds
+_ADMIN_CACHE_MAX = 4096  # entries; oldest chats are evicted beyond this
+_admin_cache: "OrderedDict[int, tuple[float, frozenset[int]]]" = OrderedDict()
+
+# In-flight admin fetches per chat: a burst of concurrent cache misses
+# awaits one shared future instead of each issuing get_administrators().
+_admin_inflight: "dict[int, asyncio.Future]" = {}
+
+_ADMIN_STATUSES = frozenset({"administrator", "creator"})
+
+
+def invalidate_admin_cache(chat_id: int) -> None:
+    """Drop the cached admin set for a chat (e.g. on membership changes)."""
+    _admin_cache.pop(chat_id, None)
+
+
+async def _on_admin_change(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Invalidate the cached admin set when admin status changes.
+
+    Telegram pushes chat_member updates on promotion/demotion; dropping the
+    entry makes the next admin check refetch the authoritative list, which
+    lets the TTL stay long without serving stale results. Requires
+    chat_member in run_polling's allowed_updates (set in main.py).
+    """
+    member_update = update.chat_member
+    if member_update is None:
+        return
+
+    was_admin = member_update.old_chat_member.status in _ADMIN_STATUSES
+    now_admin = member_update.new_chat_member.status in _ADMIN_STATUSES
+    if was_admin == now_admin:
+        return
+
+    chat_id = update.effective_chat.id
+    invalidate_admin_cache(chat_id)
+    logger.info(
+        "Admin cache invalidated for chat %s: user %s %s",
+        chat_id,
+        member_update.new_chat_member.user.id,
+        "promoted" if now_admin else "demoted",
+    )
+
+
+class AdminFilter(filters.UpdateFilter):
+    """Synchronous pre-dispatch reject for admin-only commands.
+
+    Evaluated in PTB's dispatcher before a handler coroutine is created.
+    Returns False only when the cache positively says the user is not an
+    admin; private chats, bot owners, cache misses and stale entries all
+    pass through so the admin_only decorator (which can fetch) stays the
+    authority. Known non-admin spam is dropped without ever scheduling a
+    coroutine frame.
+    """
+
+    def filter(self, update: Update) -> bool:
+        chat = update.effective_chat
+        user = update.effective_user
+        if chat is None or user is None or chat.type == "private":
+            return True
+
+        from handlers.admin import ADMIN_USERS
+        if user.id in ADMIN_USERS:
+            return True
+
+        cached = _admin_cache.get(chat.id)
+        if cached is None or time.monotonic() - cached[0] >= _ADMIN_CACHE_TTL:
+            # Unknown - let the async slow path decide (and fill the cache)
+            return True
+        return user.id in cached[1]
+
+
+async def is_user_admin(update: Update) -> bool:
+    """Check if the user is an admin in the chat."""
+    try:
+        # effective_chat/effective_user are properties that re-scan the
+        # update on every access - read each once. Private chats need no
+        # user lookup at all.
+        chat = update.effective_chat
+        if chat.type == "private":
+            logger.debug("Private chat %s: user automatically admin", chat.id)
+            return True
+
+        user_id = update.effective_user.id
+        chat_id = chat.id
+
+        # Bot owners are always treated as admins, no lookup needed.
+        # Imported lazily: handlers.admin imports this module at load time.
+        from handlers.admin import ADMIN_USERS
+        if user_id in ADMIN_USERS:
+            logger.debug("User %s is a bot owner, skipping admin lookup", user_id)
+            return True
+
+        # Serve from the cache while the entry is fresh
+        cached = _admin_cache.get(chat_id)
+        if cached and time.monotonic() - cached[0] < _ADMIN_CACHE_TTL:
+            _admin_cache.move_to_end(chat_id)
+            is_admin = user_id in cached[1]
+            logger.debug("Admin check (cached) for user %s in chat %s: %s", user_id, chat_id, is_admin)
+            return is_admin
+
+        # Single-flight per chat: the first miss owns a future and fetches;
+        # concurrent misses just await the same future.
+        inflight = _admin_inflight.get(chat_id)
+        if inflight is not None:
+            admin_ids = await inflight
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            _admin_inflight[chat_id] = fut
+            try:
+                chat_admins = await chat.get_administrators()
+                admin_ids = frozenset(admin.user.id for admin in chat_admins)
+
+                _admin_cache[chat_id] = (time.monotonic(), admin_ids)
+                _admin_cache.move_to_end(chat_id)
+                while len(_admin_cache) > _ADMIN_CACHE_MAX:
+                    _admin_cache.popitem(last=False)
+            except Exception as e:
+                # Propagate to waiters so they fail fast instead of hanging
+                fut.set_exception(e)
+                # Mark retrieved in case there were no waiters, or asyncio
+                # logs a "never retrieved" warning at GC time
+                fut.exception()
+                raise
+            else:
+                fut.set_result(admin_ids)
+            finally:
+                _admin_inflight.pop(chat_id, None)
+
+        is_admin = user_id in admin_ids
+        # Formatting the full admin-ID set is only worth it when DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Admin check for user %s in chat %s: %s", user_id, chat_id, is_admin)
+            logger.debug("Admin IDs in chat: %s", admin_ids)
+
+        return is_admin
+    except Exception as e:
+        logger.error("Error checking admin status: %s", e)
+        # Default to not admin if there's an error
+        return False
+
+
+async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Central PTB error handler: log once and send one generic reply.
+
+    Handlers no longer wrap their bodies in try/except Exception - errors
+    propagate here instead.
+    """
+    logger.error("Unhandled error while processing update", exc_info=context.error)
+    if isinstance(update, Update) and update.effective_message:
+        try:
+            await update.effective_message.reply_text(
+                "An error occurred while processing your request."
+            )
+        except Exception:
+            # Never let the error handler itself raise
+            pass
+
+
+def admin_only(func):
+    """Decorator to restrict commands to admins only."""
+    @wraps(func)
+    async def wrapped(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+        if not await is_user_admin(update):
+            logger.warning("Unauthorized access attempt by user %s in chat %s", update.effective_user.id, update.effective_chat.id)
+            await update.message.reply_text("⚠️ This command is restricted to admins only.")
+            return
+        logger.info("Admin access granted to user %s in chat %s", update.effective_user.id, update.effective_chat.id)
+        return await func(update, context, *args, **kwargs)
+    return wrapped
+
+
+@admin_only
+async def enable_janitor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Enable the janitor feature in this chat."""
+    context.chat_data["janitorEnabled"] = True
+    
+    await update.message.reply_text("Janitor has been enabled for this chat!")
+    logger.info(f"Janitor enabled in chat {update.effective_chat.id}")
+
+
+@admin_only
+async def disable_janitor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Disable the janitor feature in this chat."""
+    context.chat_data["janitorEnabled"] = False
+    
+    await update.message.reply_text("Janitor has been disabled for this chat!")
+    logger.info(f"Janitor disabled in chat {update.effective_chat.id}")
+
+
+# (message attribute, key tag, is a PhotoSize list) - probed in order by
+# _media_id; forwards carry at most one of these.
+_MEDIA_ATTRS = (
+    ("photo", "photo", True),
+    ("document", "doc", False),
+    ("video", "video", False),
+    ("audio", "audio", False),
+    ("voice", "voice", False),
+    ("sticker", "sticker", False),
+    ("animation", "animation", False),
+    ("video_note", "videonote", False),
+)
+
+
+def _content_digest(content: str) -> str:
+    """Short stable digest of message text/caption.
+
+    Python's hash() is randomized per interpreter start, which would
+    invalidate every persisted fsp_cache key on restart; a truncated
+    BLAKE2b digest survives restarts.
+    """
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def _media_id(message) -> Optional[str]:
+    """Return a "tag:file_unique_id" string for the message's media, if any.
+
+    Probes stop at the first populated attribute, so the common photo case
+    costs one getattr. Note: PTB's TelegramObject defines __slots__, so
+    going through message.__dict__.get() to skip the descriptor protocol
+    is not an option here.
+    """
+    for attr, tag, is_list in _MEDIA_ATTRS:
+        obj = getattr(message, attr, None)
+        if obj:
+            if is_list:
+                obj = obj[-1]
+            return f"{tag}:{obj.file_unique_id}"
+    return None
+
+
+def _make_forward_key(message) -> Optional[str]:
+    """Build a stable identity key for a forwarded message.
+
+    Supports both the new API (forward_origin) and the deprecated API
+    (forward_from / forward_from_chat). Returns None for anonymous/hidden
+    senders so we never delete forwards we can't reliably identify.
+    """
+    # Snapshot the forward attributes once up front. getattr (vs plain
+    # attribute access) is deliberate: forward_origin only exists on Bot
+    # API 7.0+ Message objects, and the forward_from/forward_from_chat
+    # fields are removed in newer PTB releases.
+    forward_from_chat = getattr(message, "forward_from_chat", None)
+    forward_from_message_id = getattr(message, "forward_from_message_id", None)
+    forward_origin = getattr(message, "forward_origin", None)
+    forward_from = getattr(message, "forward_from", None)
+
+    # Channel posts have a globally unique (chat, message) identity
+    if forward_from_chat is not None and forward_from_message_id is not None:
+        if forward_from_chat.type == "channel":
+            return f"chat:{forward_from_chat.id}:msg:{forward_from_message_id}"
+
+    content = message.text or message.caption
+
+    # New API: forward_origin (Bot API 7.0+)
+    if forward_origin is not None:
+        origin_chat = getattr(forward_origin, "chat", None)
+        origin_msg_id = getattr(forward_origin, "message_id", None)
+        if origin_chat is not None and origin_msg_id is not None:
+            return f"chat:{origin_chat.id}:msg:{origin_msg_id}"
+
+        sender_user = getattr(forward_origin, "sender_user", None)
+        if sender_user is None:
+            # Hidden or anonymous sender - can't identify reliably
+            return None
+
+        content_hash = _content_digest(content) if content else None
+        origin_date = getattr(forward_origin, "date", None)
+        media_id = _media_id(message)
+        # Assemble directly - no throwaway list + join on the hot path
+        return (
+            f"user:{sender_user.id}"
+            + (f":date:{int(origin_date.timestamp())}" if origin_date is not None else "")
+            + (f":text:{content_hash}" if content_hash is not None else "")
+            + (f":{media_id}" if media_id is not None else "")
+        )
+
+    # Deprecated API: forward_from / forward_date
+    if forward_from is not None:
+        content_hash = _content_digest(content) if content else None
+        forward_date = getattr(message, "forward_date", None)
+        media_id = _media_id(message)
+        return (
+            f"user:{forward_from.id}"
+            + (f":date:{int(forward_date.timestamp())}" if forward_date is not None else "")
+            + (f":text:{content_hash}" if content_hash is not None else "")
+            + (f":{media_id}" if media_id is not None else "")
+        )
+
+    # Only forward_sender_name (hidden account) - skip
+    return None
+
+
+def _cleanup_fsp_cache(cache: dict) -> None:
+    """Drop cache entries older than the 24h window."""
+    cutoff = time.time() - FSP_WINDOW
+    fresh = {key: first_seen for key, first_seen in cache.items() if first_seen >= cutoff}
+    if len(fresh) != len(cache):
+        # Mutate in place: chat_data holds this dict by identity
+        cache.clear()
+        cache.update(fresh)
+
+
+async def _fsp_gc_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Hourly job: prune stale FSP cache entries across all chats."""
+    pruned = 0
+    for chat_data in context.application.chat_data.values():
+        cache = chat_data.get("fsp_cache")
+        if cache:
+            before = len(cache)
+            _cleanup_fsp_cache(cache)
+            pruned += before - len(cache)
+    if pruned:
+        logger.info(f"FSP GC pruned {pruned} stale cache entries")
+
+
+async def _delete_after(bot, chat_id: int, message_id: int, delay: float) -> None:
+    """Sleep, then delete a message. Cheaper than a JobQueue run_once for
+    throwaway short-lived notices and keeps them out of the job store."""
+    await asyncio.sleep(delay)
+    await bot.delete_message(chat_id=chat_id, message_id=message_id)
+
+
+class _FSPEligible(filters.MessageFilter):
+    """Dispatcher-level pre-filter for forward spam protection.
+
+    Rejects linked-channel relays and Telegram service-account forwards
+    before PTB spawns the handler coroutine at all.
+    """
+
+    def filter(self, message) -> bool:
+        if getattr(message, "is_automatic_forward", False):
+            return False
+        forward_from = getattr(message, "forward_from", None)
+        if forward_from is not None and forward_from.id == 777000:
+            return False
+        return True
+
+
+async def handle_forward_spam(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Delete forwards that were already posted within the last 24 hours."""
+    # The per-chat toggle can't be expressed as a PTB filter (filters don't
+    # see chat_data), so it stays here - first, before any other work.
+    if not context.chat_data.get("forwardSpamProtectionEnabled", False):
+        return
+
+    message = update.message
+    key = _make_forward_key(message)
+    if key is None:
+        return
+
+    cache = context.chat_data.setdefault("fsp_cache", {})
+
+    now = time.time()
+    first_seen = cache.get(key)
+    # Lazy expiry: only the key being looked up is checked here; bulk
+    # pruning happens in the hourly _fsp_gc_job.
+    if first_seen is not None and now - first_seen > FSP_WINDOW:
+        del cache[key]
+        first_seen = None
+    if first_seen is not None:
+        await message.delete()
+
+        hours, rem = divmod(int(FSP_WINDOW - (now - first_seen)), 3600)
+        minutes, _ = divmod(rem, 60)
+        notice = await update.effective_chat.send_message(
+            f"🔁 Deleted a duplicate forward "
+            f"(already posted here, {hours}h {minutes}m cooldown left)"
+        )
+        context.application.create_task(
+            _delete_after(context.bot, update.effective_chat.id, notice.message_id, 6)
+        )
+        logger.info(
+            f"Deleted duplicate forward in chat {update.effective_chat.id} (key: {key})"
+        )
+        return
+
+    # First time we see this forward - just record it. No explicit flush:
+    # the debounced/interval persistence picks it up.
+    cache[key] = now
+
+
+# Prebuilt replies indexed by the new state (False -> disabled, True -> enabled)
+_FSP_REPLIES = (
+    "❌ Forward spam protection has been disabled.\n\n"
+    "When enabled, forwards re-sent within 24 hours will be automatically deleted.",
+    "✅ Forward spam protection has been enabled.\n\n"
+    "When enabled, forwards re-sent within 24 hours will be automatically deleted.",
+)
+
+
+@admin_only
+async def toggle_forward_spam(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Toggle forward spam protection for the chat."""
+    current_state = context.chat_data.get("forwardSpamProtectionEnabled", False)
+    new_state = not current_state
+    context.chat_data["forwardSpamProtectionEnabled"] = new_state
+
+    _schedule_flush(context.application)
+
+    await update.message.reply_text(_FSP_REPLIES[new_state])
+
+    status = "enabled" if new_state else "disabled"
+    logger.info(f"Forward spam protection {status} in chat {update.effective_chat.id} by user {update.effective_user.id}")
+
+
+# Built once at import; only the three dynamic fields are substituted per call
+_STATUS_TEMPLATE = """
+*Current settings for this chat:*
+
+🧹 *Janitor:* {janitor}
+📺 *Channel Filter:* {channel_filter}
+🔍 *Active Filters:* {filter_count} pattern(s)
+
+*Available Commands:*
+• `/enable_janitor` / `/disable_janitor` - Toggle message filtering
+• `/toggle_channel_filter` - Toggle external channel message filtering
+• `/add_filter <pattern>` - Add regex filter
+• `/remove_filter <number>` - Remove filter
+• `/list_filters` - Show all filters
+    """
+
+
+async def show_settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Display the current settings."""
+    janitor_status = context.chat_data.get("janitorEnabled", False)
+    channel_filter_status = context.chat_data.get("channelFilterEnabled", False)
+
+    # Count filter patterns - v2 dict first, legacy list for chats whose
+    # state hasn't been migrated yet
+    filter_count = len(
+        context.chat_data.get("filter_patterns_v2")
+        or context.chat_data.get("filter_patterns")
+        or ()
+    )
+
+    status_text = _STATUS_TEMPLATE.format(
+        janitor="enabled" if janitor_status else "disabled",
+        channel_filter="enabled" if channel_filter_status else "disabled",
+        filter_count=filter_count,
+    )
+
+    await update.message.reply_text(status_text, parse_mode="Markdown")
+    logger.info(f"Settings displayed for chat {update.effective_chat.id}")
+
+
+async def check_admin_status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Debug command to check if a user is an admin, using the best available display name."""
+    user = update.effective_user
+
+    who = (
+        f"@{user.username}"
+        if user.username
+        else (str(user.id))
+    )
+
+    is_admin = await is_user_admin(update)
+
+    if is_admin:
+        await update.message.reply_text(f"✅ {who} is an admin in this chat.")
+    else:
+        await update.message.reply_text(f"❌ {who} is NOT an admin in this chat.")
+
+    logger.info(f"Admin status check: {who} ({user.id}) in chat {update.effective_chat.id} is admin: {is_admin}")
+
+
+
+# (attribute, human label, critical for bot functionality) - drives the
+# permission report in check_all_permissions
+_BOT_PERM_FIELDS = (
+    ("can_delete_messages", "delete messages", True),
+    ("can_restrict_members", "restrict members", False),
+    ("can_change_info", "change chat info", False),
+    ("can_invite_users", "invite users", False),
+    ("can_pin_messages", "pin messages", False),
+    ("can_manage_chat", "manage chat", False),
+    ("can_manage_video_chats", "manage video chats", False),
+)
+
+_PRIVATE_CHAT_PERMS_TEXT = (
+    "✅ *Private Chat - Bot has all permissions*\n\n"
+    "In private chats, the bot can perform all actions."
+)
+
+# Pre-formatted report blocks for every bot status that needs no dynamic
+# data - only "administrator" is built per call.
+_STATUS_BLOCKS = {
+    "member": (
+        "👤 **BOT IS REGULAR MEMBER**\n\n"
+        "❌ **Bot has NO admin permissions**\n"
+        "❌ **Cannot delete messages**\n"
+        "❌ **Message filtering will NOT work**\n"
+        "❌ **Channel filtering will NOT work**\n"
+        "❌ **Janitor mode will NOT work**\n\n"
+        "⚠️ **Bot needs to be promoted to administrator with 'Delete Messages' permission!**"
+    ),
+    "restricted": (
+        "🚫 **BOT IS RESTRICTED**\n\n"
+        "❌ **Bot has restricted permissions**\n"
+        "❌ **Most bot functions will NOT work**"
+    ),
+    "left": (
+        "👻 **BOT HAS LEFT THE CHAT**\n\n"
+        "❌ **Bot is not in this chat**"
+    ),
+    "kicked": (
+        "🚫 **BOT IS BANNED**\n\n"
+        "❌ **Bot has been kicked from this chat**"
+    ),
+}
+
+_DELETE_OK_BLOCK = (
+    "✅ Message filtering will work\n"
+    "✅ Channel filtering will work\n"
+    "✅ Janitor mode will work"
+)
+
+_DELETE_MISSING_BLOCK = (
+    "❌ **Message filtering will NOT work**\n"
+    "❌ **Channel filtering will NOT work**\n"
+    "❌ **Janitor mode will NOT work**\n\n"
+    "⚠️ **Bot needs 'Delete Messages' permission to function properly!**"
+)
+
+
+async def check_all_permissions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Debug command to check all permissions for the bot in the current chat."""
+    chat = update.effective_chat
+    chat_id = chat.id
+    chat_type = chat.type
+    bot_id = context.bot.id
+    
+    # For private chats, bot has all permissions
+    if chat_type == "private":
+        await update.message.reply_text(_PRIVATE_CHAT_PERMS_TEXT, parse_mode="Markdown")
+        logger.info(f"Bot permission check: Bot {bot_id} in private chat - all permissions granted")
+        return
+    
+    # Get bot's member info in the chat
+    try:
+        bot_member = await chat.get_member(bot_id)
+        status = bot_member.status
+        
+        # Build the report as a list of fragments; join once at the end
+        # instead of repeated += string copies.
+        parts = [
+            "*Bot Permission Report*\n\n",
+            f"**Chat:** {chat.title or 'Unknown'}\n",
+            f"**Chat Type:** {chat_type}\n",
+            f"**Bot Status:** {status}\n",
+            f"**Bot ID:** {bot_id}\n\n",
+        ]
+
+
+        if status == "administrator":
+            # Check specific admin permissions for the bot
+            bot_perms = []
+            for attr, label, critical in _BOT_PERM_FIELDS:
+                if getattr(bot_member, attr, False):
+                    bot_perms.append(f"✅ Can {label}")
+                elif critical:
+                    bot_perms.append(f"❌ **Cannot {label}** (CRITICAL)")
+                else:
+                    bot_perms.append(f"❌ Cannot {label}")
+
+            parts.append("🤖 **BOT IS ADMINISTRATOR**\n\n")
+            parts.append("**Bot Permissions:**\n")
+            parts.append("\n".join(bot_perms))
+
+            # Check if bot can perform its core functions
+            can_delete = getattr(bot_member, 'can_delete_messages', False)
+
+            parts.append("\n\n**Bot Functionality Status:**\n")
+            parts.append(_DELETE_OK_BLOCK if can_delete else _DELETE_MISSING_BLOCK)
+
+        else:
+            parts.append(_STATUS_BLOCKS.get(status, ""))
+
+        await update.message.reply_text("".join(parts), parse_mode="Markdown")
+        logger.info(f"Bot permission check completed for chat {chat_id}: status={status}")
+        
+    except Exception as member_error:
+        logger.error(f"Error getting bot member info: {member_error}")
+        await update.message.reply_text(
+            f"❌ **Error checking bot permissions**\n\n"
+            f"Could not retrieve bot member information.\n"
+            f"Error: {str(member_error)}",
+            parse_mode="Markdown"
+        )
+        
+
+# Command-name -> handler table: one CommandHandler covers all of these,
+# so PTB's per-update handler scan checks a single entry and dispatch is
+# a dict lookup on the command word.
+_COMMANDS = {
+    "enable_janitor": enable_janitor,
+    "disable_janitor": disable_janitor,
+    "status": show_settings,
+    "amiadmin": check_admin_status,
+    "botperms": check_all_permissions,
+}
+
+
+async def _dispatch_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Route a command update to its handler via _COMMANDS."""
+    word = update.effective_message.text.split(None, 1)[0]
+    command = word[1:].split("@", 1)[0].lower()
+    handler = _COMMANDS.get(command)
+    if handler is not None:
+        await handler(update, context)
+
+
+_handlers_registered = False
+
+
+def register_conversation_handlers(application):
+    """Register command handlers with the application."""
+    # Fail fast if wired twice - duplicate registration would double every
+    # handler invocation (and the Bot API calls they make). A module-level
+    # flag is used because PTB's Application defines __slots__.
+    global _handlers_registered
+    if _handlers_registered:
+        raise RuntimeError("register_conversation_handlers called twice")
+    _handlers_registered = True
+
+    # One handler for all plain conversation commands - see _COMMANDS
+    application.add_handler(CommandHandler(list(_COMMANDS), _dispatch_command))
+    application.add_error_handler(on_error)
+    # AdminFilter cheaply drops known non-admins before dispatch; the
+    # admin_only decorator remains the authoritative (cache-filling) check.
+    application.add_handler(
+        CommandHandler("toggle_forward_spam", toggle_forward_spam, filters=AdminFilter())
+    )
+
+    # Forward spam protection - runs in the default group alongside commands
+    application.add_handler(MessageHandler(
+        filters.FORWARDED & ~filters.StatusUpdate.ALL & _FSPEligible(),
+        handle_forward_spam
+    ))
+
+    # Admin promotions/demotions are pushed to us - keep the cache fresh
+    application.add_handler(
+        ChatMemberHandler(_on_admin_change, ChatMemberHandler.CHAT_MEMBER)
+    )
+
+    # Bulk FSP cache cleanup runs off the message hot path
+    if application.job_queue:
+        application.job_queue.run_repeating(_fsp_gc_job, interval=3600, first=3600)
+
+    logger.info("Settings handlers registered") 
@@ -1,84 +1,160 @@
 import logging
+import time
 from datetime import datetime
 from telegram import Update
-from telegram.ext import ContextTypes, CommandHandler
+from telegram.ext import ContextTypes, CommandHandler, filters
 from telegram.constants import ParseMode
 import os
 
 logger = logging.getLogger("telegram_bot")
 
 
-ADMIN_USER_IDS = [352475318]
+# frozenset for O(1) membership checks on every admin command
+ADMIN_USER_IDS: frozenset = frozenset({352475318})
+
+# Checked synchronously in PTB's dispatcher: commands from anyone else
+# never create a handler coroutine (and get no "unauthorized" reply).
+ADMIN_FILTER = filters.User(user_id=list(ADMIN_USER_IDS))
+
+# Refresh the cached member count at most this often - it changes rarely
+# but track_chat runs on every message.
+_MEMBER_COUNT_TTL = 600  # seconds
+
+# Rewrite a chat's tracked entry at most this often. Every write dirties
+# bot_data and gets re-pickled on the next persistence flush, so busy
+# chats would otherwise amplify every message into serialization work.
+_ACTIVITY_WRITE_INTERVAL = 30  # seconds
+
+# In-memory last-write times per chat - deliberately not persisted, a
+# restart just means one extra write per chat.
+_last_activity_write: dict = {}
+
+
+def _chats_index(bot_data) -> dict:
+    """Return the type -> chat-id index, building it fully if missing.
+
+    Built in one pass over tracked_chats, so state persisted before the
+    index existed (including the checked-in bot_data snapshot) is covered
+    completely. Growing it incrementally instead would make admin reads
+    trust a partial index and silently drop every chat that hasn't sent
+    a message since the upgrade.
+    """
+    by_type = bot_data.get("_chats_by_type")
+    if by_type is None:
+        by_type = {}
+        for cid, entry in bot_data.get("tracked_chats", {}).items():
+            by_type.setdefault(entry.get("type", "unknown"), set()).add(cid)
+        bot_data["_chats_by_type"] = by_type
+    return by_type
 
-def is_admin(user_id):
-    """Check if a user is authorized to use admin commands."""
-    return user_id in ADMIN_USER_IDS
 
 async def track_chat(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Track chats the bot is added to."""
     chat = update.effective_chat
-    
-    # Initialize bot_data structure if not exists
-    if "tracked_chats" not in context.bot_data:
-        context.bot_data["tracked_chats"] = {}
-    
-    # Get member count safely
-    member_count = "Unknown"
-    try:
-        # Only get member count for groups and supergroups
-        if chat.type in ["group", "supergroup"]:
-            # get_member_count() is a method that returns a coroutine
-            # We need to await it to get the actual count
+    if chat is None:
+        return
+
+    tracked = context.bot_data.setdefault("tracked_chats", {})
+    existing = tracked.get(chat.id)
+
+    # Coalesce writes: if we refreshed this chat's entry recently there is
+    # nothing worth dirtying the persistence backend for.
+    now = time.time()
+    if existing is not None and now - _last_activity_write.get(chat.id, 0.0) < _ACTIVITY_WRITE_INTERVAL:
+        return
+    _last_activity_write[chat.id] = now
+
+    # Reuse the cached member count unless it's stale - the API round-trip
+    # is far too expensive to pay per message.
+    member_count = existing.get("members", "Unknown") if existing else "Unknown"
+    members_ts = existing.get("members_ts", 0.0) if existing else 0.0
+    if chat.type in {"group", "supergroup"} and now - members_ts > _MEMBER_COUNT_TTL:
+        # Record the attempt time even on failure so errors don't turn into
+        # a refetch on every message.
+        members_ts = now
+        try:
             member_count = await context.bot.get_chat_member_count(chat.id)
-    except Exception as e:
-        logger.error(f"Error getting member count for chat {chat.id}: {e}")
-    
+        except Exception as e:
+            logger.error(f"Error getting member count for chat {chat.id}: {e}")
+
     # Store or update chat info with only serializable data
-    context.bot_data["tracked_chats"][chat.id] = {
+    tracked[chat.id] = {
         "chat_id": chat.id,
         "title": chat.title or (f"Private chat with {update.effective_user.first_name}" if chat.type == "private" else "Unknown"),
         "type": chat.type,
         "members": member_count,
+        "members_ts": members_ts,
         "username": chat.username,
-        "last_activity": datetime.now().isoformat(),
+        # Stored as epoch seconds; formatted only when an admin reads it
+        "last_activity_ts": now,
     }
+
+    # Secondary index: chat ids partitioned by type, so admin reads don't
+    # have to scan every tracked chat.
+    by_type = _chats_index(context.bot_data)
+    if existing is not None and existing.get("type") != chat.type:
+        old_ids = by_type.get(existing.get("type"))
+        if old_ids:
+            old_ids.discard(chat.id)
+    by_type.setdefault(chat.type, set()).add(chat.id)
     
     # Don't force persistence update on every message
     # Let the application handle persistence based on its schedule
     # await context.application.update_persistence()  # Removed this line
 
+# Per-group block for admin_list_groups, formatted with str.format so the
+# literal is built once at import instead of per group per call.
+_GROUP_TPL = (
+    "*{i}. {title}*\n"
+    "ID: `{cid}`\n"
+    "Type: {type}\n"
+    "Username: {username}\n"
+    "Last activity: {last_activity}"
+)
+
+
+def _format_last_activity(chat_entry) -> str:
+    """Render a tracked chat's last activity, handling pre-migration entries.
+
+    New entries store epoch seconds under last_activity_ts; old persisted
+    entries still carry an ISO string under last_activity.
+    """
+    ts = chat_entry.get("last_activity_ts")
+    if ts is not None:
+        return datetime.fromtimestamp(ts).isoformat(timespec="seconds")
+    return chat_entry.get("last_activity", "Unknown")
+
+
 async def admin_list_groups(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """List all groups the bot is in (admin only)."""
+    """List all groups the bot is in (admin only, enforced by ADMIN_FILTER)."""
     user_id = update.effective_user.id
-    
-    if not is_admin(user_id):
-        await update.message.reply_text("⛔ You are not authorized to use this command.")
-        logger.warning(f"Unauthorized access attempt to admin command by user {user_id}")
-        return
-    
+
     if "tracked_chats" not in context.bot_data or not context.bot_data["tracked_chats"]:
         await update.message.reply_text("No tracked chats available.")
         return
     
-    groups = [
-        chat for chat_id, chat in context.bot_data["tracked_chats"].items() 
-        if chat.get("type") in ["group", "supergroup"]
-    ]
-    
+    tracked = context.bot_data["tracked_chats"]
+    by_type = _chats_index(context.bot_data)
+    group_ids = by_type.get("group", set()) | by_type.get("supergroup", set())
+    groups = [tracked[cid] for cid in group_ids if cid in tracked]
+
     if not groups:
         await update.message.reply_text("Bot is not in any groups.")
         return
-    
-    # Prepare a formatted list of groups
-    groups_text = "\n\n".join([
-        f"*{i+1}. {g['title']}*\n"
-        f"ID: `{g['chat_id']}`\n"
-        f"Type: {g['type']}\n"
-        f"Username: {g.get('username', 'None')}\n"
-        f"Last activity: {g.get('last_activity', 'Unknown')}"
+
+    # Generator feeds join directly - no intermediate list of blocks
+    groups_text = "\n\n".join(
+        _GROUP_TPL.format(
+            i=i + 1,
+            title=g["title"],
+            cid=g["chat_id"],
+            type=g["type"],
+            username=g.get("username", "None"),
+            last_activity=_format_last_activity(g),
+        )
         for i, g in enumerate(groups)
-    ])
-    
+    )
+
     await update.message.reply_text(
         f"🤖 *Bot is in {len(groups)} groups:*\n\n{groups_text}",
         parse_mode=ParseMode.MARKDOWN
@@ -86,14 +162,9 @@ async def admin_list_groups(update: Update, context: ContextTypes.DEFAULT_TYPE)
     logger.info(f"Admin {user_id} requested group list")
 
 async def admin_group_filters(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Show filters configured for a specific group (admin only)."""
+    """Show filters configured for a specific group (admin only, enforced by ADMIN_FILTER)."""
     user_id = update.effective_user.id
-    
-    if not is_admin(user_id):
-        await update.message.reply_text("⛔ You are not authorized to use this command.")
-        logger.warning(f"Unauthorized access attempt to admin command by user {user_id}")
-        return
-    
+
     # Get group ID from command arguments
     if not context.args or len(context.args) < 1:
         await update.message.reply_text(
@@ -114,19 +185,16 @@ async def admin_group_filters(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(f"No data found for group ID {group_id}")
         return
     
-    # Get filter patterns for this group
-    filter_patterns = chat_data.get("filter_patterns", [])
-    
+    # Get filter patterns for this group - filter_patterns_v2 is the dict
+    # keyed by pattern; fall back to the legacy list for unmigrated chats
+    filter_patterns = chat_data.get("filter_patterns_v2") or chat_data.get("filter_patterns") or []
+
     if not filter_patterns:
         await update.message.reply_text(f"No filter patterns configured for group ID {group_id}")
         return
-    
-    # Convert to list if it's a set
-    if isinstance(filter_patterns, set):
-        filter_patterns = list(filter_patterns)
-    
-    # Format the filter patterns
-    patterns_text = "\n".join([f"{i+1}. `{pattern}`" for i, pattern in enumerate(filter_patterns)])
+
+    # Format the filter patterns (iterating a dict yields its keys)
+    patterns_text = "\n".join(f"{i+1}. `{pattern}`" for i, pattern in enumerate(filter_patterns))
     
     # Get group name from tracked chats if available
     group_name = "Unknown Group"
@@ -140,64 +208,51 @@ async def admin_group_filters(update: Update, context: ContextTypes.DEFAULT_TYPE
     logger.info(f"Admin {user_id} requested filters for group {group_id}")
 
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Show bot statistics and diagnostics (admin only)."""
+    """Show bot statistics and diagnostics (admin only, enforced by ADMIN_FILTER)."""
     user_id = update.effective_user.id
-    
-    if not is_admin(user_id):
-        await update.message.reply_text("⛔ You are not authorized to use this command.")
-        logger.warning(f"Unauthorized access attempt to admin command by user {user_id}")
-        return
-    
-    # Gather statistics
-    total_chats = 0
-    private_chats = 0
-    groups = 0
-    supergroups = 0
-    channels = 0
-    total_filters = 0
-    
-    if "tracked_chats" in context.bot_data:
-        for chat_id, chat in context.bot_data["tracked_chats"].items():
-            total_chats += 1
-            chat_type = chat.get("type", "unknown")
-            if chat_type == "private":
-                private_chats += 1
-            elif chat_type == "group":
-                groups += 1
-            elif chat_type == "supergroup":
-                supergroups += 1
-            elif chat_type == "channel":
-                channels += 1
-            
-            # Count filters
-            chat_data = context.application.chat_data.get(chat_id, {})
-            filters_count = len(chat_data.get("filter_patterns", []))
-            total_filters += filters_count
-    
-    # Bot uptime
-    bot_start_time = context.bot_data.get("start_time", "Unknown")
-    uptime_str = "Unknown"
-    if bot_start_time != "Unknown":
-        try:
-            start_time = datetime.fromisoformat(bot_start_time)
-            uptime = datetime.now() - start_time
-            days = uptime.days
-            hours, remainder = divmod(uptime.seconds, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            uptime_str = f"{days}d {hours}h {minutes}m {seconds}s"
-        except Exception as e:
-            logger.error(f"Error calculating uptime: {e}")
-            uptime_str = "Error calculating"
-    
+
+    # Gather statistics in single passes - one over tracked chats for the
+    # type histogram, one over chat_data for filter counts. Avoids the
+    # per-chat chat_data lookup the old nested loop did.
+    tracked = context.bot_data.get("tracked_chats", {})
+    total_chats = len(tracked)
+    # len() per partition - no iteration over tracked chats at all
+    chat_types = {t: len(ids) for t, ids in _chats_index(context.bot_data).items()}
+    total_filters = sum(
+        len(cd.get("filter_patterns_v2") or cd.get("filter_patterns") or ())
+        for cd in context.application.chat_data.values()
+    )
+
+    # Bot uptime - integer arithmetic on the epoch start time
+    start_ts = context.bot_data.get("start_time_ts")
+    if start_ts is None:
+        # Persisted state from before start_time_ts stored an ISO string
+        old_iso = context.bot_data.get("start_time")
+        if old_iso:
+            try:
+                start_ts = datetime.fromisoformat(old_iso).timestamp()
+                context.bot_data["start_time_ts"] = start_ts
+            except ValueError as e:
+                logger.error(f"Error parsing legacy start_time: {e}")
+
+    if start_ts is not None:
+        elapsed = int(time.time() - start_ts)
+        days, rem = divmod(elapsed, 86400)
+        hours, rem = divmod(rem, 3600)
+        minutes, seconds = divmod(rem, 60)
+        uptime_str = f"{days}d {hours}h {minutes}m {seconds}s"
+    else:
+        uptime_str = "Unknown"
+
     # Format statistics
     stats_text = (
         f"*🤖 Bot Statistics*\n\n"
         f"*Chats:*\n"
         f"• Total chats: {total_chats}\n"
-        f"• Private chats: {private_chats}\n"
-        f"• Groups: {groups}\n"
-        f"• Supergroups: {supergroups}\n"
-        f"• Channels: {channels}\n\n"
+        f"• Private chats: {chat_types.get('private', 0)}\n"
+        f"• Groups: {chat_types.get('group', 0)}\n"
+        f"• Supergroups: {chat_types.get('supergroup', 0)}\n"
+        f"• Channels: {chat_types.get('channel', 0)}\n\n"
         f"*Filters:*\n"
         f"• Total filter patterns: {total_filters}\n\n"
         f"*Performance:*\n"
@@ -212,11 +267,11 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
 def register_diagnostic_handlers(application):
     """Register diagnostic handlers with the application."""
-    # Admin commands
-    #application.add_handler(CommandHandler("admin_list_groups", admin_list_groups))
-    #application.add_handler(CommandHandler("admin_group_filters", admin_group_filters))
-    #application.add_handler(CommandHandler("admin_stats", admin_stats))
-    
+    # Admin commands - ADMIN_FILTER rejects non-owners in the dispatcher
+    application.add_handler(CommandHandler("admin_list_groups", admin_list_groups, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("admin_group_filters", admin_group_filters, filters=ADMIN_FILTER))
+    application.add_handler(CommandHandler("admin_stats", admin_stats, filters=ADMIN_FILTER))
+
     logger.info("Diagnostic handlers registered")
 
     # Note: track_chat is not a command, it should be called from other handlers
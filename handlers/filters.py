@@ -1,5 +1,10 @@
+import asyncio
+import functools
 import logging
 import re
+import time
+from collections import deque
+from html import escape
 from telegram import Update
 from telegram.constants import ParseMode
 from telegram.ext import (
@@ -10,87 +15,394 @@ from telegram.ext import (
     filters,
 )
 from telegram.error import BadRequest
-from handlers.conversation import admin_only
+from handlers.conversation import admin_only, _schedule_flush
 
 logger = logging.getLogger("telegram_bot")
 
 
+_LITERAL_CHARS = frozenset(
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 "
+)
+
+
+def _extract_literal(pattern: str):
+    """Return the longest plain-text run a match of `pattern` must contain.
+
+    Conservative scan: runs end at any metacharacter, content inside
+    [...], (...) or {m,n} and escape sequences is ignored, and a trailing
+    char made optional by * ? { is dropped. Returns the run lowercased (the
+    filters are IGNORECASE), or None when the pattern has no usable
+    literal - callers then skip the prefilter for that pattern.
+    """
+    # Alternation breaks the "must contain" guarantee (a match may use the
+    # other branch), so bail out conservatively.
+    if "|" in pattern:
+        return None
+
+    runs = [""]
+    in_class = False
+    in_brace = False
+    depth = 0
+    i = 0
+    n = len(pattern)
+    while i < n:
+        ch = pattern[i]
+        if ch == "\\":
+            i += 2
+            runs.append("")
+            continue
+        if in_class:
+            if ch == "]":
+                in_class = False
+            i += 1
+            continue
+        if in_brace:
+            # Quantifier bounds like {2,5} are counts, not text the
+            # message must contain
+            if ch == "}":
+                in_brace = False
+            i += 1
+            continue
+        if ch == "[":
+            in_class = True
+            runs.append("")
+        elif ch == "(":
+            depth += 1
+            runs.append("")
+        elif ch == ")":
+            depth = max(0, depth - 1)
+            runs.append("")
+        elif depth == 0 and ch in _LITERAL_CHARS:
+            runs[-1] += ch
+        else:
+            if ch in "*?{" and runs[-1]:
+                # Quantifier makes the preceding char optional
+                runs[-1] = runs[-1][:-1]
+            if ch == "{":
+                in_brace = True
+            runs.append("")
+        i += 1
+
+    best = max(runs, key=len)
+    return best.lower() if best else None
+
+
+@functools.lru_cache(maxsize=2048)
+def _compile(pattern: str, flags: int):
+    """Process-wide compile cache.
+
+    Popular patterns recur across chats; compiling each once per process
+    beats per-chat compiles and doesn't contend with re's small shared
+    internal cache.
+    """
+    return re.compile(pattern, flags)
+
+
+def _compile_entry(pattern: str) -> tuple:
+    """Compile one pattern into its (regex, required-literal) entry."""
+    return (_compile(pattern, re.IGNORECASE), _extract_literal(pattern))
+
+
+def _filters_dict(chat_data) -> dict:
+    """Return the chat's pattern dict, migrating the legacy list once.
+
+    filter_patterns_v2 maps pattern string -> (compiled regex, literal),
+    so membership tests and removals are O(1) and the compiled entries
+    live in the same structure instead of a parallel cache. Insertion
+    order is preserved, keeping /list_filters numbering stable.
+    """
+    filters_d = chat_data.get("filter_patterns_v2")
+    if filters_d is None:
+        filters_d = {p: _compile_entry(p) for p in chat_data.get("filter_patterns") or ()}
+        chat_data["filter_patterns_v2"] = filters_d
+        # Retire the pre-migration structures
+        chat_data.pop("filter_patterns", None)
+        chat_data.pop("_compiled_filter_patterns", None)
+    return filters_d
+
+
+# Backreferences break under alternation: joining patterns renumbers
+# capture groups, so \1 silently points at the wrong group while still
+# compiling cleanly. Matches \<digit> and (?P=name); the escaped-backslash
+# false positive (\\1) just costs the fast path for that chat.
+_BACKREF_RE = re.compile(r"\\\d|\(\?P=")
+
+
+def _rebuild_combined(chat_data) -> None:
+    """Rebuild the combined alternation regex from the pattern dict.
+
+    One combined alternation scans the message in a single pass; most
+    messages match nothing, so this rejects them without running every
+    pattern individually. Per-pattern search only happens on a hit, to
+    identify which pattern matched for the notification.
+    """
+    patterns = list(chat_data.get("filter_patterns_v2") or ())
+    combined = None
+    if patterns and not any(_BACKREF_RE.search(p) for p in patterns):
+        try:
+            combined = re.compile(
+                "|".join(f"(?:{p})" for p in patterns), re.IGNORECASE
+            )
+        except re.error as e:
+            # Patterns that are valid alone can clash when combined
+            # (e.g. flag scopes); fall back to the per-pattern loop.
+            logger.warning(f"Could not build combined filter regex: {e}")
+    chat_data["_combined_filter_regex"] = combined
+
+
+@admin_only
+async def add_filter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Add a regex filter pattern for this chat."""
+    if not context.args:
+        await update.message.reply_text("Usage: /add_filter <pattern>")
+        return
+
+    pattern = " ".join(context.args)
+    try:
+        # Also warms the process-wide cache for the _compile_entry below
+        _compile(pattern, re.IGNORECASE)
+    except re.error as e:
+        await update.message.reply_text(f"Invalid regex pattern: {e}")
+        return
+
+    filters_d = _filters_dict(context.chat_data)
+    if pattern in filters_d:
+        await update.message.reply_text("That pattern is already in the filter list.")
+        return
+
+    filters_d[pattern] = _compile_entry(pattern)
+    _rebuild_combined(context.chat_data)
+    # Debounced - the reply below doesn't wait on a full pickle of the store
+    _schedule_flush(context.application)
+
+    await update.message.reply_text(f"Filter added: `{pattern}`", parse_mode=ParseMode.MARKDOWN)
+    logger.info(f"Filter '{pattern}' added in chat {update.effective_chat.id}")
+
+
+@admin_only
+async def remove_filter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Remove a filter pattern by its number (see /list_filters)."""
+    filters_d = _filters_dict(context.chat_data)
+    if not filters_d:
+        await update.message.reply_text("No filter patterns configured for this chat.")
+        return
+
+    try:
+        index = int(context.args[0]) - 1
+    except (IndexError, ValueError):
+        await update.message.reply_text("Usage: /remove_filter <number>")
+        return
+
+    if not 0 <= index < len(filters_d):
+        await update.message.reply_text(
+            f"Invalid filter number. Use /list_filters to see the {len(filters_d)} configured filters."
+        )
+        return
+
+    removed = list(filters_d)[index]
+    del filters_d[removed]
+    _rebuild_combined(context.chat_data)
+    _schedule_flush(context.application)
+
+    await update.message.reply_text(f"Filter removed: `{removed}`", parse_mode=ParseMode.MARKDOWN)
+    logger.info(f"Filter '{removed}' removed in chat {update.effective_chat.id}")
+
+
+@admin_only
+async def list_filters(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """List the filter patterns configured for this chat."""
+    filters_d = _filters_dict(context.chat_data)
+    if not filters_d:
+        await update.message.reply_text("No filter patterns configured for this chat.")
+        return
+
+    patterns_text = "\n".join(f"{i+1}. `{p}`" for i, p in enumerate(filters_d))
+    await update.message.reply_text(
+        f"*Filter patterns for this chat:*\n\n{patterns_text}",
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+
+@admin_only
+async def whitelist_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Exempt a channel (by @username or numeric id) from the channel filter."""
+    if not context.args:
+        await update.message.reply_text("Usage: /whitelist_channel <@username or channel id>")
+        return
+
+    entry = context.args[0].lstrip("@")
+    whitelist = context.chat_data.setdefault("channelWhitelist", [])
+    if entry in whitelist:
+        await update.message.reply_text(f"Channel `{entry}` is already whitelisted.", parse_mode=ParseMode.MARKDOWN)
+        return
+
+    whitelist.append(entry)
+    # Shadow set for O(1) lookups on the message hot path; the list stays
+    # the persisted form
+    context.chat_data["_channelWhitelist_set"] = set(whitelist)
+    _schedule_flush(context.application)
+
+    await update.message.reply_text(f"Channel `{entry}` whitelisted.", parse_mode=ParseMode.MARKDOWN)
+    logger.info("Channel %s whitelisted in chat %s", entry, update.effective_chat.id)
+
+
+@admin_only
+async def unwhitelist_channel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Remove a channel from the channel-filter whitelist."""
+    if not context.args:
+        await update.message.reply_text("Usage: /unwhitelist_channel <@username or channel id>")
+        return
+
+    entry = context.args[0].lstrip("@")
+    whitelist = context.chat_data.get("channelWhitelist") or []
+    if entry not in whitelist:
+        await update.message.reply_text(f"Channel `{entry}` is not whitelisted.", parse_mode=ParseMode.MARKDOWN)
+        return
+
+    whitelist.remove(entry)
+    context.chat_data["_channelWhitelist_set"] = set(whitelist)
+    _schedule_flush(context.application)
+
+    await update.message.reply_text(f"Channel `{entry}` removed from the whitelist.", parse_mode=ParseMode.MARKDOWN)
+    logger.info("Channel %s unwhitelisted in chat %s", entry, update.effective_chat.id)
+
+
+# Self-destructing notices wait in this bot_data deque as
+# (due_ts, chat_id, message_id) triples; appends happen in time order so
+# a popleft-while-due drain is enough. One repeating job replaces a
+# run_once job per notice.
+_NOTICE_TTL = 30  # seconds
+
+
+async def _drain_pending_deletes(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Delete all due self-destruct notices in one batch."""
+    pending = context.application.bot_data.get("_pending_deletes")
+    if not pending:
+        return
+
+    now = time.time()
+    due = []
+    while pending and pending[0][0] <= now:
+        due.append(pending.popleft())
+    if not due:
+        return
+
+    results = await asyncio.gather(
+        *(context.bot.delete_message(chat_id=c, message_id=m) for _, c, m in due),
+        return_exceptions=True,
+    )
+    for (_, chat_id, message_id), result in zip(due, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to delete notice %s in chat %s: %s", message_id, chat_id, result)
+
+
+def _schedule_notice_delete(context, chat_id: int, message_id: int) -> None:
+    """Queue a notice for deletion after _NOTICE_TTL seconds."""
+    context.application.bot_data.setdefault("_pending_deletes", deque()).append(
+        (time.time() + _NOTICE_TTL, chat_id, message_id)
+    )
+
+
+class JanitorActive(filters.MessageFilter):
+    """Dispatcher-level gate for filter_message.
+
+    Evaluated synchronously in PTB's dispatch loop, so chats with neither
+    the janitor nor the channel filter enabled never spawn the handler
+    coroutine at all. Holds the Application to reach chat_data before a
+    context exists.
+    """
+
+    def __init__(self, application):
+        super().__init__()
+        self._application = application
+
+    def filter(self, message) -> bool:
+        chat_data = self._application.chat_data.get(message.chat_id)
+        if not chat_data:
+            return False
+        return bool(
+            chat_data.get("janitorEnabled") or chat_data.get("channelFilterEnabled")
+        )
+
+
 async def filter_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Check if a message matches any filter patterns and delete if it does."""
-    # Log all message details for debugging
-    if update.message:
-        logger.info(f"Message update details:")
-        logger.info(f"  Chat ID: {update.effective_chat.id}")
-        logger.info(f"  Chat type: {update.effective_chat.type}")
-        logger.info(f"  From user: {update.message.from_user}")
-        logger.info(f"  Sender chat: {update.message.sender_chat}")
-        if update.message.sender_chat:
-            logger.info(f"    Sender chat ID: {update.message.sender_chat.id}")
-            logger.info(f"    Sender chat type: {update.message.sender_chat.type}")
-            logger.info(f"    Sender chat title: {update.message.sender_chat.title}")
-        logger.info(f"  Message text: {update.message.text[:50] if update.message.text else 'No text'}")
-        logger.info(f"  Is automatic forward: {update.message.is_automatic_forward}")
-        
-        # Check for forward origin safely
-        if hasattr(update.message, 'forward_origin') and update.message.forward_origin:
-            logger.info(f"  Forward origin: {update.message.forward_origin}")
-        else:
-            logger.info(f"  Forward origin: None")
-            
-        logger.info("---")
+    # Per-message diagnostics only when DEBUG is on - the repr/format work
+    # below is pure overhead for every non-matching message otherwise
+    if update.message and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "msg chat=%s type=%s from=%s sender_chat=%s text=%.50s auto_fwd=%s fwd_origin=%s",
+            update.effective_chat.id,
+            update.effective_chat.type,
+            update.message.from_user,
+            update.message.sender_chat,
+            update.message.text or "",
+            update.message.is_automatic_forward,
+            getattr(update.message, 'forward_origin', None),
+        )
 
     # Check channel filter first - delete messages from external channels if enabled
-    # BUT skip automatic forwards and whitelisted channels
-    if (context.chat_data.get("channelFilterEnabled", False) and
-        update.message.sender_chat and 
-        update.message.sender_chat.id != update.effective_chat.id and
-        update.message.sender_chat.type == "channel" and
-        not update.message.is_automatic_forward):  # Skip automatic forwards
-        
-        # Check if this channel is whitelisted
-        channel_whitelist = context.chat_data.get("channelWhitelist", [])
-        channel_username = update.message.sender_chat.username
-        channel_id = update.message.sender_chat.id
-        
+    # BUT skip automatic forwards and whitelisted channels. sender_chat is
+    # None for nearly every message, so that test leads; the chat_data
+    # lookups only run for actual channel posts.
+    sender_chat = update.message.sender_chat
+    if (sender_chat is not None and
+        sender_chat.type == "channel" and
+        sender_chat.id != update.effective_chat.id and
+        not update.message.is_automatic_forward and  # Skip automatic forwards
+        context.chat_data.get("channelFilterEnabled", False)):
+
+        # Check if this channel is whitelisted - the shadow set gives O(1)
+        # membership; rebuild it once for state persisted before it existed
+        whitelist = context.chat_data.get("_channelWhitelist_set")
+        if whitelist is None:
+            whitelist = set(context.chat_data.get("channelWhitelist", []))
+            context.chat_data["_channelWhitelist_set"] = whitelist
+        channel_username = sender_chat.username
+        channel_id = sender_chat.id
+
         # Skip deletion if channel is whitelisted (by username or ID)
-        if (channel_username and channel_username in channel_whitelist) or (str(channel_id) in channel_whitelist):
-            logger.info(f"Channel {channel_username or channel_id} is whitelisted, skipping deletion")
+        if (channel_username and channel_username in whitelist) or (str(channel_id) in whitelist):
+            logger.info("Channel %s is whitelisted, skipping deletion", channel_username or channel_id)
             return
         
+        channel_name = sender_chat.title or f"Channel {channel_id}"
+
+        # Delete first - the "Deleted a message" notice is only truthful
+        # (and only worth a round-trip) once the delete has succeeded,
+        # e.g. it must not fire when the bot lacks Delete Messages
         try:
-            channel_name = update.message.sender_chat.title or f"Channel {update.message.sender_chat.id}"
             await update.message.delete()
-            
-            # Send notification that will self-destruct
-            notification = await update.effective_chat.send_message(
-                f"🚫 Deleted a message from channel: {channel_name}",
-                parse_mode=ParseMode.HTML
-            )
-            
-            # Schedule deletion of our notification after 30 seconds
-            context.job_queue.run_once(
-                delete_message_job,
-                30,
-                data={
-                    'chat_id': update.effective_chat.id,
-                    'message_id': notification.message_id
-                }
-            )
-            
-            logger.info(f"Deleted channel message from {channel_name} in chat {update.effective_chat.id}")
-            return  # Exit early, don't process regex filters
-            
         except BadRequest as e:
             logger.error(f"Failed to delete channel message: {e} - Chat: {update.effective_chat.id}")
         except Exception as e:
             logger.error(f"Error deleting channel message: {e}")
+        else:
+            logger.info("Deleted channel message from %s in chat %s", channel_name, update.effective_chat.id)
+            try:
+                notification = await update.effective_chat.send_message(
+                    f"🚫 Deleted a message from channel: <b>{escape(channel_name)}</b>",
+                    parse_mode=ParseMode.HTML
+                )
+            except Exception as e:
+                logger.error(f"Failed to send channel-filter notification: {e}")
+            else:
+                _schedule_notice_delete(context, update.effective_chat.id, notification.message_id)
+            return  # Exit early, don't process regex filters
 
     # Skip regex filtering if janitor is not enabled
     if not context.chat_data.get("janitorEnabled", False):
         return
     
-    # Skip if there are no filter patterns
-    if "filter_patterns" not in context.chat_data or not context.chat_data["filter_patterns"]:
+    # Skip if there are no filter patterns. Go through _filters_dict only
+    # when legacy list state needs migrating; the common case is one get.
+    filters_d = context.chat_data.get("filter_patterns_v2")
+    if filters_d is None:
+        if not context.chat_data.get("filter_patterns"):
+            return
+        filters_d = _filters_dict(context.chat_data)
+        _rebuild_combined(context.chat_data)
+    if not filters_d:
         return
 
     # Get the message content - could be either text or caption
@@ -100,62 +412,99 @@ async def filter_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     if not message_content:
         return
 
-    # Skip commands, only filter regular messages
-    if message_content.startswith('/'):
+    # Fast reject: one scan over the message for the common no-match case
+    if "_combined_filter_regex" not in context.chat_data:
+        _rebuild_combined(context.chat_data)
+    combined = context.chat_data.get("_combined_filter_regex")
+    if combined is not None and not combined.search(message_content):
         return
-    
-    # Check message against each pattern
-    for pattern in context.chat_data["filter_patterns"]:
+
+    # Lowercased once for the C-level substring prefilter below
+    lowered = message_content.lower()
+
+    # Hoisted out of the loop: effective_user is a property walk and the
+    # fallback chain shouldn't be re-run per pattern
+    user = update.effective_user
+    uid = user.id
+    username = user.username or user.first_name or f"User {uid}"
+
+    for pattern, (regex, literal) in filters_d.items():
+        # A pattern can't match if its required literal isn't present,
+        # and str.__contains__ is far cheaper than regex search
+        if literal and literal not in lowered:
+            continue
+
+        # No try around .search(): every stored pattern already passed
+        # re.compile in add_filter.
+        if not regex.search(message_content):
+            continue
+
+        # Delete first; the notice only goes out after a successful
+        # delete (see channel branch above). A failed delete won't
+        # succeed for a later pattern either, so stop rather than spam
+        # one false "Deleted" notice per matching pattern.
+        try:
+            await update.message.delete()
+        except BadRequest as e:
+            logger.error(
+                "Failed to delete message: %s - User: %s, Chat: %s",
+                e, uid, update.effective_chat.id,
+            )
+            return
+        except Exception as e:
+            logger.error(f"Error in filter_message: {e}")
+            return
+
+        logger.info(
+            "Deleted message from user %s in chat %s matching pattern '%s'",
+            uid,
+            update.effective_chat.id,
+            pattern,
+        )
         try:
-            if re.search(pattern, message_content, re.IGNORECASE):
-                # Try to delete the message
-                try:
-                    user = update.effective_user
-                    username = user.username or user.first_name or f"User {user.id}"
-                    
-                    # Delete the original message
-                    await update.message.delete()
-                    
-                    # Send notification that will self-destruct
-                    notification = await update.effective_chat.send_message(
-                        f"Deleted a message from {username} \nMatched filter pattern: `{pattern}`",
-                        parse_mode=ParseMode.HTML
-                    )
-                    
-                    # Schedule deletion of our notification after 30 seconds
-                    context.job_queue.run_once(
-                        delete_message_job,
-                        30,
-                        data={
-                            'chat_id': update.effective_chat.id,
-                            'message_id': notification.message_id
-                        }
-                    )
-                    
-                    logger.info(
-                        f"Deleted message from user {update.effective_user.id} in chat "
-                        f"{update.effective_chat.id} matching pattern '{pattern}'"
-                    )
-                    return  # Stop after first match and deletion
-                except BadRequest as e:
-                    logger.error(
-                        f"Failed to delete message: {e} - User: {update.effective_user.id}, "
-                        f"Chat: {update.effective_chat.id}"
-                    )
-                except Exception as e:
-                    logger.error(f"Error in filter_message: {e}")
+            notification = await update.effective_chat.send_message(
+                f"Deleted a message from {escape(username)}\n"
+                f"Matched filter pattern: <code>{escape(pattern)}</code>",
+                parse_mode=ParseMode.HTML
+            )
         except Exception as e:
-            logger.error(f"Error matching pattern '{pattern}': {e}")
+            logger.error(f"Failed to send filter notification: {e}")
+        else:
+            _schedule_notice_delete(context, update.effective_chat.id, notification.message_id)
+        return  # Stop after first match and deletion
 
 
 
+_handlers_registered = False
+
+
 def register_filter_handlers(application):
     """Register filter handlers with the application."""
- 
-    # Single message filter handler that handles both channel filtering and regex filtering
-    #application.add_handler(MessageHandler(
-    #    (filters.TEXT | filters.CAPTION) & ~filters.COMMAND, 
-    #    filter_message
-    #), group=1)
-    
-    logger.info("Filter handlers registered") 
+    # Fail fast if wired twice - a duplicate registration would run
+    # filter_message (and the notice-drain job) twice per message
+    global _handlers_registered
+    if _handlers_registered:
+        raise RuntimeError("register_filter_handlers called twice")
+    _handlers_registered = True
+
+    # Filter management commands (chat-admin gated)
+    application.add_handler(CommandHandler("add_filter", add_filter))
+    application.add_handler(CommandHandler("remove_filter", remove_filter))
+    application.add_handler(CommandHandler("list_filters", list_filters))
+    application.add_handler(CommandHandler("whitelist_channel", whitelist_channel))
+    application.add_handler(CommandHandler("unwhitelist_channel", unwhitelist_channel))
+
+    # Single message filter handler that handles both channel filtering and
+    # regex filtering. group=1 so it runs after command handlers.
+    # JanitorActive skips dispatch entirely for chats with both features off.
+    application.add_handler(MessageHandler(
+        (filters.TEXT | filters.CAPTION) & ~filters.COMMAND & JanitorActive(application),
+        filter_message
+    ), group=1)
+
+    # One repeating drain handles every self-destruct notice, instead of a
+    # fresh scheduler job per deleted message
+    if application.job_queue:
+        application.job_queue.run_repeating(_drain_pending_deletes, interval=1.0, first=1.0)
+
+    logger.info("Filter handlers registered")
@@ -1,76 +1,312 @@
+import asyncio
 import logging
-import requests
-import shlex
+import random
+from typing import Optional
+
+import httpx
+import orjson
 from telegram import Update, Poll
 from telegram.ext import ContextTypes, CommandHandler
 
+from utils.cache import TTLCache
+from utils.circuit import CircuitBreaker
+from utils.ratelimit import rate_limited
+
 logger = logging.getLogger("telegram_bot")
 
+# Shared async HTTP client - reused across calls so TCP/TLS setup is paid
+# once, not per /joke. Module-level rather than bot_data because bot_data
+# is pickled by PicklePersistence and a live client isn't picklable.
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        # HTTP/2 lets all providers on one host share a multiplexed
+        # connection; the keepalive pool keeps warm requests from paying
+        # TCP/TLS setup again
+        _http_client = httpx.AsyncClient(
+            timeout=3.0,
+            http2=True,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+    return _http_client
+
+
+async def init_http_client(application) -> None:
+    """post_init hook: build the shared HTTP client up front."""
+    _get_http_client()
+
+
+async def close_http_client(application) -> None:
+    """post_shutdown hook: release the shared HTTP client."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def _parse_jokeapi(d) -> str:
+    return d['joke'] if d['type'] == 'single' else f"{d['setup']}\n\n{d['delivery']}"
+
+
+def _parse_official_joke(d) -> str:
+    return f"{d['setup']}\n\n{d['punchline']}"
+
+
+def _parse_chucknorris(d) -> str:
+    return d['value']
+
+
+# Each provider paired with its response parser, so dispatch is a direct
+# call instead of substring-matching the URL per response
 JOKE_APIS = [
-    "https://v2.jokeapi.dev/joke/Any?blacklistFlags=nsfw,religious,political,racist,sexist,explicit",
-    "https://official-joke-api.appspot.com/random_joke",
-    "https://api.chucknorris.io/jokes/random"
+    ("https://v2.jokeapi.dev/joke/Any?blacklistFlags=nsfw,religious,political,racist,sexist,explicit", _parse_jokeapi),
+    ("https://official-joke-api.appspot.com/random_joke", _parse_official_joke),
+    ("https://api.chucknorris.io/jokes/random", _parse_chucknorris),
 ]
 
-async def joke(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Fetch and send a random joke from multiple sources."""
-    for api_url in JOKE_APIS:
+
+# Caps concurrent provider fetches; sized to the current provider list,
+# it's pure headroom today but keeps fan-out bounded as providers grow
+_fetch_semaphore = asyncio.Semaphore(3)
+
+
+class _JokeFound(Exception):
+    """Raised inside the fetch TaskGroup to carry out the first success.
+
+    TaskGroup cancels the remaining siblings when a child raises, which
+    gives us first-wins semantics with guaranteed cleanup.
+    """
+
+    def __init__(self, text: str):
+        super().__init__(text)
+        self.text = text
+
+
+def _joke_state(bot_data):
+    """Return the (cache, breaker) pair living in bot_data.
+
+    Both objects are picklable, so keeping them in bot_data means
+    PicklePersistence carries the warm cache and recent circuit state
+    across restarts. Created lazily here rather than in
+    register_fun_handlers because persisted bot_data is only loaded at
+    application initialize, after handler registration.
+    """
+    cache = bot_data.get("joke_cache")
+    if cache is None:
+        # Recently fetched jokes; jokes are interchangeable within a couple
+        # of minutes, so most /joke calls can skip the network entirely
+        cache = bot_data["joke_cache"] = TTLCache(max_size=200, ttl=120)
+    breaker = bot_data.get("joke_breaker")
+    if breaker is None:
+        # Skips providers that recently failed so a dead endpoint doesn't
+        # cost its full timeout on every /joke
+        breaker = bot_data["joke_breaker"] = CircuitBreaker(
+            failure_threshold=3, break_duration=30, sampling_duration=60
+        )
+    return cache, breaker
+
+
+# Transient server errors worth a blind retry. 429 is retried too but
+# honors the provider's retry-after; plain 4xx (bad request, auth, not
+# found) will fail identically on retry.
+_RETRYABLE_STATUSES = frozenset({500, 502, 503, 504})
+
+
+def _retry_after_seconds(response) -> float:
+    """Seconds to wait per the retry-after header, capped and defaulted.
+
+    Capped at 3s so a user-facing race never stalls longer than the
+    request timeout; non-numeric values (HTTP-date form) fall back to 1s.
+    """
+    try:
+        return min(float(response.headers.get("retry-after", 1)), 3.0)
+    except ValueError:
+        return 1.0
+
+
+async def _get_with_retry(client: httpx.AsyncClient, url: str, max_tries: int = 3):
+    """GET with exponential backoff + full jitter on transient failures."""
+    response = None
+    for i in range(max_tries):
         try:
-            response = requests.get(api_url, timeout=3)
-            if response.status_code == 200:
-                joke_data = response.json()
-                
-                if "chucknorris.io" in api_url:
-                    joke_text = joke_data['value']
-                elif "jokeapi.dev" in api_url:
-                    if joke_data['type'] == 'single':
-                        joke_text = joke_data['joke']
-                    else:
-                        joke_text = f"{joke_data['setup']}\n\n{joke_data['delivery']}"
-                elif "appspot.com" in api_url:
-                    joke_text = f"{joke_data['setup']}\n\n{joke_data['punchline']}"
-                
-                await update.message.reply_text(joke_text)
-                return
-                
-        except Exception as e:
-            logger.warning(f"Failed to fetch from {api_url}: {e}")
+            response = await client.get(url)
+        except httpx.HTTPError as e:
+            if i == max_tries - 1:
+                raise
+            logger.debug("Retrying %s after network error: %s", url, e)
+            await asyncio.sleep(random.uniform(0, 0.2 * 2 ** (i + 1)))
             continue
-    
-    await update.message.reply_text("Couldn't fetch a joke right now. Try again later!")
+        status = response.status_code
+        if status == 429 and i < max_tries - 1:
+            # The provider told us when to come back - honor that instead
+            # of guessing with jitter
+            await asyncio.sleep(_retry_after_seconds(response))
+        elif status in _RETRYABLE_STATUSES and i < max_tries - 1:
+            await asyncio.sleep(random.uniform(0, 0.2 * 2 ** (i + 1)))
+        else:
+            break
+    return response
 
 
+async def _fetch_joke(bot_data) -> Optional[str]:
+    """Race the joke providers; cache and return the first success."""
+    client = _get_http_client()
+    cache, breaker = _joke_state(bot_data)
+
+    async def _try(url, parser):
+        async with _fetch_semaphore:
+            try:
+                response = await _get_with_retry(client, url)
+            except Exception as e:
+                breaker.record_failure(url)
+                logger.warning("Joke fetch failed: %s", e)
+                return
+            status = response.status_code
+            if status != 200:
+                # 429/5xx count against the provider's breaker; any other
+                # 4xx on our fixed URLs is our bug, not provider health
+                if status == 429 or 500 <= status < 600:
+                    breaker.record_failure(url)
+                return
+            breaker.record_success(url)
+            try:
+                # orjson decodes these small payloads several times faster
+                # than the stdlib json response.json() would use
+                joke_text = parser(orjson.loads(response.content))
+            except (KeyError, ValueError) as e:
+                logger.warning("Bad joke payload from %s: %s", url, e)
+                return
+            if joke_text:
+                cache.put(hash(joke_text), joke_text)
+                raise _JokeFound(joke_text)
+
+    # All providers race inside the TaskGroup; the first success raises
+    # _JokeFound, which cancels the rest - first-wins latency with no
+    # leaked tasks. Providers with an open breaker are skipped entirely.
+    joke_text = None
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for url, parser in JOKE_APIS:
+                if not breaker.is_open(url):
+                    tg.create_task(_try(url, parser))
+    except* _JokeFound as found:
+        joke_text = found.exceptions[0].text
+    return joke_text
+
+
+# At most two cache refills in flight; a burst of /joke then costs
+# bounded upstream traffic no matter how many users pile on
+_refill_semaphore = asyncio.Semaphore(2)
+
+
+async def _background_refill(bot_data) -> None:
+    """Top up the joke cache without a user waiting on the result."""
+    if _refill_semaphore.locked():
+        # Enough refills already running - skip rather than queue up
+        return
+    async with _refill_semaphore:
+        await _fetch_joke(bot_data)
+
+
+@rate_limited(5, 60)
+async def joke(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Fetch and send a random joke from multiple sources."""
+    # Stale-while-revalidate: any warm cache answers instantly and a
+    # background task tops it up; upstream is only awaited inline when
+    # the cache is empty
+    cache, _ = _joke_state(context.bot_data)
+    cached = cache.random()
+    if cached is not None:
+        await update.message.reply_text(cached)
+        context.application.create_task(_background_refill(context.bot_data))
+        return
+
+    joke_text = await _fetch_joke(context.bot_data)
+    if joke_text:
+        await update.message.reply_text(joke_text)
+    else:
+        await update.message.reply_text("Couldn't fetch a joke right now. Try again later!")
+
+
+# /poll reply strings, built once instead of per invocation
+_POLL_EXAMPLE = "Example: /poll \"Favorite Person?\" \"Me\" \"Myself\" \"I\""
+_POLL_USAGE = (
+    "Usage: /poll \"Question\" \"Option1\" \"Option2\" ...\n" + _POLL_EXAMPLE
+)
+_POLL_NEED_OPTIONS = "You need at least 1 question and 2 options.\n" + _POLL_EXAMPLE
+_POLL_TOO_LONG = "Too long: questions are capped at 300 characters and options at 100."
+_POLL_INVALID_FORMAT = (
+    "Invalid format. Make sure to use quotes correctly.\n" + _POLL_EXAMPLE
+)
+_POLL_FAILED = "Couldn't create the poll. Please try again."
+
+
+def _parse_poll_args(args: list) -> list:
+    """Merge quoted runs of already-split args into single tokens.
+
+    PTB has whitespace-split the command line for us; all /poll needs is
+    stitching \"quoted phrases\" back together, not the full POSIX lexer
+    (backslash escapes, comments, ...) shlex would run. Raises ValueError
+    on an unterminated quote.
+    """
+    if not any('"' in arg for arg in args):
+        return list(args)
+    tokens = []
+    run = None
+    for arg in args:
+        if run is None:
+            if arg.startswith('"'):
+                if len(arg) > 1 and arg.endswith('"'):
+                    tokens.append(arg[1:-1])
+                else:
+                    run = [arg[1:]]
+            else:
+                tokens.append(arg)
+        elif arg.endswith('"'):
+            run.append(arg[:-1])
+            tokens.append(' '.join(run))
+            run = None
+        else:
+            run.append(arg)
+    if run is not None:
+        raise ValueError("No closing quotation")
+    return tokens
+
+
+@rate_limited(5, 60)
 async def create_poll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Create a poll from command arguments with proper quoted string handling."""
     if not context.args:
-        await update.message.reply_text(
-            "Usage: /poll \"Question\" \"Option1\" \"Option2\" ...\n"
-            "Example: /poll \"Favorite Person?\" \"Me\" \"Myself\" \"I\""
-        )
+        await update.message.reply_text(_POLL_USAGE)
         return
-    
+
+    # Quoting only ever merges tokens, so fewer than 3 raw args can never
+    # parse into a question plus 2 options - bail before parsing
+    if len(context.args) < 3:
+        await update.message.reply_text(_POLL_NEED_OPTIONS)
+        return
+
     try:
-       
-        parsed_args = shlex.split(' '.join(context.args))
-        
+
+        parsed_args = _parse_poll_args(context.args)
+
         if len(parsed_args) < 3:
-            await update.message.reply_text(
-                "You need at least 1 question and 2 options.\n"
-                "Example: /poll \"Favorite Person?\" \"Me\" \"Myself\" \"I\""
-            )
+            await update.message.reply_text(_POLL_NEED_OPTIONS)
             return
             
         question = parsed_args[0]
-        options = parsed_args[1:]
-        
-      
-        if len(options) < 2:
-            await update.message.reply_text("You need at least 2 options for a poll.")
+        # Cap at Telegram's 10-option maximum up front; the length check
+        # above already guarantees at least 2
+        options = parsed_args[1:11]
+
+        # Telegram rejects questions >300 chars and options >100 chars -
+        # catch that locally instead of paying an API round trip
+        if len(question) > 300 or any(len(option) > 100 for option in options):
+            await update.message.reply_text(_POLL_TOO_LONG)
             return
-        if len(options) > 10:
-            await update.message.reply_text("You can have maximum 10 options in a poll.")
-            options = options[:10]  
-            
+
         await context.bot.send_poll(
             chat_id=update.effective_chat.id,
             question=question,
@@ -80,13 +316,10 @@ async def create_poll(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         )
         
     except ValueError as e:
-        await update.message.reply_text(
-            "Invalid format. Make sure to use quotes correctly.\n"
-            "Example: /poll \"Favorite Person?\" \"Me\" \"Myself\" \"I\""
-        )
+        await update.message.reply_text(_POLL_INVALID_FORMAT)
         logger.error(f"Poll command error: {e}")
     except Exception as e:
-        await update.message.reply_text("Couldn't create the poll. Please try again.")
+        await update.message.reply_text(_POLL_FAILED)
         logger.error(f"Poll creation error: {e}")
 
 def register_fun_handlers(application):
@@ -1,6 +1,6 @@
 import logging
 import os
-from datetime import datetime
+import time
 from dotenv import load_dotenv
 
 # Import handlers
@@ -10,12 +10,12 @@ from handlers.conversation import register_conversation_handlers
 from handlers.filters import register_filter_handlers
 from handlers.diagnostics import register_diagnostic_handlers, track_chat
 from utils.logger import setup_logger
-from handlers.fun import register_fun_handlers
+from handlers.fun import register_fun_handlers, init_http_client, close_http_client
 from handlers.games import register_games_handlers
 from handlers.coupons import register_coupon_handlers
 
 from telegram import Update
-from telegram.ext import ApplicationBuilder, PicklePersistence, ChatMemberHandler, MessageHandler, filters, ContextTypes
+from telegram.ext import ApplicationBuilder, PicklePersistence, MessageHandler, filters
 
 # Load environment variables
 load_dotenv()
@@ -31,18 +31,31 @@ def main() -> None:
         logger.error("No token provided. Set TELEGRAM_BOT_TOKEN environment variable.")
         return
 
-    # Setup persistence with a reasonable update interval
+    # Setup persistence with a reasonable update interval. Each flush
+    # pickles all of bot_data/chat_data synchronously, so a long interval
+    # keeps that off the event loop; commands that must not lose state
+    # already flush explicitly via update_persistence/_schedule_flush,
+    # and PTB flushes once more on shutdown.
     persistence_path = os.getenv("PERSISTENCE_PATH", "bot_data")
+    persistence_interval = int(os.getenv("PERSISTENCE_INTERVAL", "300"))
     persistence = PicklePersistence(
         filepath=persistence_path,
-        update_interval=60  # Save every 60 seconds instead of every message
+        update_interval=persistence_interval
     )
     
     # Create application with persistence
-    application = ApplicationBuilder().token(token).persistence(persistence).build()
+    application = (
+        ApplicationBuilder()
+        .token(token)
+        .persistence(persistence)
+        .post_init(init_http_client)
+        .post_shutdown(close_http_client)
+        .build()
+    )
     
-    # Record bot start time
-    application.bot_data["start_time"] = datetime.now().isoformat()
+    # Record bot start time as epoch seconds - uptime becomes plain float
+    # subtraction in /admin_stats instead of ISO parsing
+    application.bot_data["start_time_ts"] = time.time()
     
     # Register handlers
     register_basic_handlers(application)
@@ -53,20 +66,18 @@ def main() -> None:
     register_fun_handlers(application)
     register_games_handlers(application)
     register_coupon_handlers(application)
-    # Add a chat update handler to track groups
+    # Add a chat update handler to track groups. Edited messages are
+    # skipped - the original message already counted for activity - but
+    # private chats stay in, since /admin_stats reports them too.
     application.add_handler(
-        MessageHandler(filters.ALL, track_chat_activity),
+        MessageHandler(filters.ALL & ~filters.UpdateType.EDITED_MESSAGE, track_chat),
         group=999  # High group number to run after other handlers
     )
     
-    # Start the Bot
+    # Start the Bot. chat_member updates are opt-in and needed for the
+    # event-driven admin cache in handlers/conversation.py.
     logger.info("Starting bot")
-    application.run_polling()
-
-async def track_chat_activity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Track chat activity for monitoring."""
-    if update.effective_chat:
-        await track_chat(update, context)
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,52 @@
+import random
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Small bounded TTL + LRU cache.
+
+    Entries live in an OrderedDict as (timestamp, value): reads move an
+    entry to the end (LRU), inserts evict the oldest entries past
+    max_size, and expired entries are dropped lazily on access. Holds no
+    locks or other unpicklable state, so instances can sit in bot_data.
+    """
+
+    def __init__(self, max_size: int = 200, ttl: float = 120.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        timestamp, value = entry
+        if time.time() - timestamp > self.ttl:
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value) -> None:
+        self._entries[key] = (time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def random(self, default=None):
+        """Return a random non-expired value, or default if empty."""
+        self._prune()
+        if not self._entries:
+            return default
+        key = random.choice(tuple(self._entries))
+        return self._entries[key][1]
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.ttl
+        stale = [k for k, (ts, _) in self._entries.items() if ts < cutoff]
+        for key in stale:
+            del self._entries[key]
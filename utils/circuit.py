@@ -0,0 +1,59 @@
+import time
+from collections import defaultdict, deque
+
+
+class CircuitBreaker:
+    """Per-key circuit breaker over a sliding sampling window.
+
+    Outcomes are recorded per key as (timestamp, ok) events kept for
+    sampling_duration seconds. A key opens when at least failure_threshold
+    failures are in the window and they make up half or more of its calls;
+    open keys are skipped for break_duration seconds, after which the next
+    check lets a probe through (half-open) with a cleared window, so a
+    single fresh failure can re-open it.
+
+    Uses wall-clock time and holds only plain containers, so instances
+    can be persisted in bot_data and stay meaningful across restarts.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = 3,
+        break_duration: float = 30.0,
+        sampling_duration: float = 60.0,
+    ):
+        self.failure_threshold = failure_threshold
+        self.break_duration = break_duration
+        self.sampling_duration = sampling_duration
+        self._events: defaultdict = defaultdict(deque)
+        self._open_until: dict = {}
+
+    def is_open(self, key) -> bool:
+        until = self._open_until.get(key)
+        if until is None:
+            return False
+        if time.time() < until:
+            return True
+        # Cooldown elapsed - go half-open: drop the stale window and let
+        # the next call probe the endpoint
+        del self._open_until[key]
+        self._events[key].clear()
+        return False
+
+    def record_success(self, key) -> None:
+        self._record(key, True)
+
+    def record_failure(self, key) -> None:
+        events = self._record(key, False)
+        failures = sum(1 for _, ok in events if not ok)
+        if failures >= self.failure_threshold and failures / len(events) >= 0.5:
+            self._open_until[key] = time.time() + self.break_duration
+
+    def _record(self, key, ok: bool) -> deque:
+        now = time.time()
+        events = self._events[key]
+        cutoff = now - self.sampling_duration
+        while events and events[0][0] <= cutoff:
+            events.popleft()
+        events.append((now, ok))
+        return events
@@ -0,0 +1,54 @@
+import functools
+import time
+from collections import defaultdict, deque
+
+
+class SlidingWindow:
+    """Sliding-window call counter keyed by an arbitrary hashable.
+
+    Per key, timestamps of recent calls live in a deque; a call is allowed
+    when fewer than max_calls remain inside the window after pruning. No
+    locking - the single-process event loop already serializes handlers.
+    """
+
+    def __init__(self, max_calls: int, period: float):
+        self.max_calls = max_calls
+        self.period = period
+        self._calls: defaultdict = defaultdict(deque)
+
+    def allow(self, key) -> bool:
+        now = time.monotonic()
+        window = self._calls[key]
+        cutoff = now - self.period
+        while window and window[0] <= cutoff:
+            window.popleft()
+        if len(window) >= self.max_calls:
+            return False
+        window.append(now)
+        return True
+
+
+def rate_limited(max_calls: int, period: float):
+    """Limit a command handler to max_calls per period per chat.
+
+    Keyed by (chat_id, handler name) so each command gets its own budget.
+    Rejected calls get a short notice instead of running the handler.
+    """
+
+    def decorator(func):
+        window = SlidingWindow(max_calls, period)
+
+        @functools.wraps(func)
+        async def wrapper(update, context, *args, **kwargs):
+            chat = update.effective_chat
+            if chat is not None and not window.allow((chat.id, func.__name__)):
+                if update.effective_message:
+                    await update.effective_message.reply_text(
+                        "Slow down a bit - try again in a minute."
+                    )
+                return
+            return await func(update, context, *args, **kwargs)
+
+        return wrapper
+
+    return decorator